@@ -1,10 +1,12 @@
 
 
 import sqlite3
+import threading
 from sqlite3 import Connection
 from datetime import datetime, timedelta
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+import pyarrow as pa
 import streamlit as st
 
 DB_PATH = "shop.db"
@@ -12,11 +14,40 @@ DB_PATH = "shop.db"
 # --------------------------
 # Database helpers
 # --------------------------
-def get_conn(path=DB_PATH) -> Connection:
-    conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
+# One shared writer and one shared reader connection per process. Streamlit runs
+# each rerun on a different thread, so each connection is used under its own
+# lock; WAL keeps the reader on committed data while a write is in flight.
+@st.cache_resource
+def get_conn(path=DB_PATH, readonly=False) -> Connection:
+    conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES,
+                           check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    # WAL lets dashboard reads run alongside order writes; keep hot pages in memory
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-20000")   # ~20 MB page cache
+    conn.execute("PRAGMA mmap_size=134217728") # 128 MB
+    conn.execute("PRAGMA busy_timeout=5000")
+    if readonly:
+        conn.execute("PRAGMA query_only=ON")
     return conn
 
+@st.cache_resource
+def get_write_lock() -> threading.Lock:
+    return threading.Lock()
+
+@st.cache_resource
+def get_read_lock() -> threading.Lock:
+    return threading.Lock()
+
+# Process-wide write counter that keys the cache_data results below. It must
+# outlive sessions so a write in one tab invalidates every other tab's cache;
+# bump it under get_write_lock() once the write has committed.
+@st.cache_resource
+def get_data_version() -> dict:
+    return {'value': 0}
+
 def init_db(conn: Connection):
     cur = conn.cursor()
     cur.executescript("""
@@ -41,12 +72,62 @@ def init_db(conn: Connection):
         product_id INTEGER NOT NULL,
         qty INTEGER NOT NULL,
         unit_price REAL NOT NULL,
+        product_name TEXT,
+        cost_price REAL,
         FOREIGN KEY (order_id) REFERENCES orders(id),
         FOREIGN KEY (product_id) REFERENCES products(id)
     );
+
+    CREATE TABLE IF NOT EXISTS product_stats (
+        product_id INTEGER PRIMARY KEY,
+        units_sold INTEGER,
+        profit REAL
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_oi_order ON order_items(order_id);
+    CREATE INDEX IF NOT EXISTS idx_oi_product ON order_items(product_id);
+    CREATE INDEX IF NOT EXISTS idx_orders_time ON orders(order_time);
+    CREATE INDEX IF NOT EXISTS idx_products_stock ON products(stock_qty);
     """)
+    # Older databases predate the denormalized name/cost columns on order_items
+    cols = {r["name"] for r in cur.execute("PRAGMA table_info(order_items)")}
+    if "product_name" not in cols:
+        cur.executescript("""
+        ALTER TABLE order_items ADD COLUMN product_name TEXT;
+        ALTER TABLE order_items ADD COLUMN cost_price REAL;
+        UPDATE order_items SET
+            product_name = (SELECT name FROM products WHERE id = order_items.product_id),
+            cost_price = (SELECT cost_price FROM products WHERE id = order_items.product_id);
+        """)
+    if cur.execute("SELECT count(*) FROM product_stats").fetchone()[0] == 0:
+        refresh_stats(conn)
     conn.commit()
 
+def refresh_stats(conn: Connection):
+    """Rebuild the per-product sales summary from all of order_items.
+
+    Used after seeding and migration; runs inside the caller's transaction.
+    """
+    conn.execute("DELETE FROM product_stats")
+    conn.execute("""
+    INSERT INTO product_stats (product_id, units_sold, profit)
+    SELECT product_id, SUM(qty), SUM((unit_price - cost_price) * qty)
+    FROM order_items
+    GROUP BY product_id
+    """)
+
+def add_order_stats(conn: Connection, lines):
+    """Fold one order's (product_id, qty, profit) lines into product_stats.
+
+    Touches only the order's products; runs inside the caller's transaction.
+    """
+    conn.executemany("""
+    INSERT INTO product_stats (product_id, units_sold, profit) VALUES (?, ?, ?)
+    ON CONFLICT(product_id) DO UPDATE SET
+        units_sold = units_sold + excluded.units_sold,
+        profit = profit + excluded.profit
+    """, lines)
+
 def seed_dummy_data(conn: Connection, force=False):
     cur = conn.cursor()
     cur.execute("SELECT count(*) as c FROM products")
@@ -70,10 +151,9 @@ def seed_dummy_data(conn: Connection, force=False):
         ("Salt 1kg", 12.0, 20.0, 40),
         ("Tea Pack 100g", 30.0, 45.0, 3),
     ]
-    for name, cost, sell, stock in products:
-        cur.execute("INSERT INTO products (name, cost_price, selling_price, stock_qty) VALUES (?, ?, ?, ?)",
-                    (name, cost, sell, stock))
-    conn.commit()
+    conn.execute("BEGIN")
+    cur.executemany("INSERT INTO products (name, cost_price, selling_price, stock_qty) VALUES (?, ?, ?, ?)", products)
+    catalog = {r["id"]: r for r in cur.execute("SELECT id, name, cost_price, selling_price FROM products")}
 
     # Create dummy orders for past 30 days
     now = datetime.now()
@@ -86,74 +166,95 @@ def seed_dummy_data(conn: Connection, force=False):
         ("Neha", now - timedelta(days=8), [(1, 1), (8, 1)]),
         ("LocalShop", now - timedelta(days=6), [(9, 5), (2, 5)]),
     ]
+    order_items, stock_updates = [], []
     for cust, otime, items in sample_orders:
-        total = 0.0
-        cur.execute("INSERT INTO orders (order_time, customer_name, total_amount) VALUES (?, ?, ?)", (otime, cust, 0.0))
+        lines = [(pid, qty, catalog[pid]) for pid, qty in items if pid in catalog]
+        total = sum(p["selling_price"] * qty for _, qty, p in lines)
+        cur.execute("INSERT INTO orders (order_time, customer_name, total_amount) VALUES (?, ?, ?)", (otime, cust, total))
         order_id = cur.lastrowid
-        for pid, qty in items:
-            cur.execute("SELECT selling_price FROM products WHERE id = ?", (pid,))
-            row = cur.fetchone()
-            if not row:
-                continue
-            unit = row["selling_price"]
-            cur.execute("INSERT INTO order_items (order_id, product_id, qty, unit_price) VALUES (?, ?, ?, ?)",
-                        (order_id, pid, qty, unit))
-            total += unit * qty
-            cur.execute("UPDATE products SET stock_qty = CASE WHEN stock_qty - ? < 0 THEN 0 ELSE stock_qty - ? END WHERE id = ?",
-                        (qty, qty, pid))
-        cur.execute("UPDATE orders SET total_amount = ? WHERE id = ?", (total, order_id))
+        order_items += [(order_id, pid, qty, p["selling_price"], p["name"], p["cost_price"]) for pid, qty, p in lines]
+        stock_updates += [(qty, pid) for pid, qty, _ in lines]
+    cur.executemany("INSERT INTO order_items (order_id, product_id, qty, unit_price, product_name, cost_price) VALUES (?, ?, ?, ?, ?, ?)",
+                    order_items)
+    cur.executemany("UPDATE products SET stock_qty = MAX(stock_qty - ?, 0) WHERE id = ?", stock_updates)
+    refresh_stats(conn)
     conn.commit()
 
 # --------------------------
 # Analytics
 # --------------------------
-def load_tables(conn: Connection):
-    products = pd.read_sql_query("SELECT * FROM products", conn)
-    orders = pd.read_sql_query("SELECT * FROM orders", conn, parse_dates=["order_time"])
-    order_items = pd.read_sql_query("SELECT oi.*, p.name as product_name, p.cost_price FROM order_items oi JOIN products p ON oi.product_id=p.id", conn)
-    return products, orders, order_items
-
-def compute_best_selling(order_items):
-    if order_items.empty:
-        return pd.DataFrame()
-    summary = order_items.groupby('product_id', as_index=False).agg({'qty':'sum'})
-    summary = summary.merge(order_items[['product_id','product_name']].drop_duplicates(), on='product_id', how='left')
-    return summary.sort_values('qty', ascending=False).head(5)
-
-def compute_top_profit_products(order_items):
-    if order_items.empty:
-        return pd.DataFrame()
-    df = order_items.copy()
-    df['profit'] = (df['unit_price'] - df['cost_price']) * df['qty']
-    profit_summary = df.groupby(['product_id','product_name'], as_index=False)['profit'].sum()
-    return profit_summary.sort_values('profit', ascending=False).head(5)
-
-def compute_customers_per_hour(orders):
-    if orders.empty:
-        return pd.DataFrame()
-    orders['hour'] = orders['order_time'].dt.hour
-    per_hour = orders.groupby('hour', as_index=False)['id'].count().rename(columns={'id':'customers'})
-    full = pd.DataFrame({'hour': range(0, 24)})
-    return full.merge(per_hour, on='hour', how='left').fillna({'customers':0})
-
-def compute_low_stock(products, order_items, threshold=2):
-    low = products[products['stock_qty'] < threshold].copy()
-    if low.empty:
-        return low
-    # Past 30-day sales
-    last_30 = datetime.now() - timedelta(days=30)
-    recent_sales = order_items[order_items['id'].isin(order_items.index)]
-    recent_sales = recent_sales[recent_sales['id']>0] # dummy safety
-    order_recent = pd.read_sql_query("SELECT * FROM orders", get_conn(), parse_dates=['order_time'])
-    order_recent = order_recent[order_recent['order_time'] >= last_30]
-    if not order_recent.empty:
-        recent_ids = order_recent['id'].tolist()
-        sales_30d = order_items[order_items['order_id'].isin(recent_ids)].groupby('product_id', as_index=False)['qty'].sum()
-        low = low.merge(sales_30d, left_on='id', right_on='product_id', how='left').fillna({'qty':0})
-        low.rename(columns={'qty':'sold_last_30d'}, inplace=True)
-    else:
-        low['sold_last_30d'] = 0
-    return low[['id','name','stock_qty','sold_last_30d']]
+def _count(conn: Connection, table: str) -> int:
+    return conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+
+# Results are cached per data version; `version` is bumped on every write so a
+# plain rerun (widget click, mode switch) never touches SQLite or pandas again.
+# Leading-underscore args are skipped by Streamlit's hasher, and max_entries
+# evicts the results of superseded versions.
+@st.cache_data(show_spinner=False, max_entries=4)
+def load_tables(_conn: Connection, version: int):
+    with get_read_lock():
+        # Arrow-backed columns keep the text fields out of per-cell Python objects
+        return pd.read_sql_query("SELECT * FROM products", _conn, dtype_backend="pyarrow")
+
+def _to_arrow(df: pd.DataFrame) -> pa.Table:
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+# Dashboard tiles are cached as Arrow tables, which round-trip through the
+# cache as raw column buffers; convert with .to_pandas() at the display site.
+@st.cache_data(show_spinner=False, max_entries=4)
+def compute_best_selling(_conn: Connection, version: int) -> pa.Table:
+    with get_read_lock():
+        if _count(_conn, "product_stats") == 0:
+            return _to_arrow(pd.DataFrame(columns=['product_id','qty','product_name']))
+        best = pd.read_sql_query("""
+            SELECT s.product_id, s.units_sold AS qty, p.name AS product_name
+            FROM product_stats s JOIN products p ON p.id = s.product_id
+            ORDER BY qty DESC
+            LIMIT 5
+        """, _conn)
+        return _to_arrow(best)
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def compute_top_profit_products(_conn: Connection, version: int) -> pa.Table:
+    with get_read_lock():
+        if _count(_conn, "product_stats") == 0:
+            return _to_arrow(pd.DataFrame(columns=['product_id','product_name','profit']))
+        profit = pd.read_sql_query("""
+            SELECT s.product_id, p.name AS product_name, s.profit
+            FROM product_stats s JOIN products p ON p.id = s.product_id
+            ORDER BY profit DESC
+            LIMIT 5
+        """, _conn)
+        return _to_arrow(profit)
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def compute_customers_per_hour(_conn: Connection, version: int) -> pa.Table:
+    with get_read_lock():
+        counts = np.zeros(24, dtype=np.int64)
+        if _count(_conn, "orders") > 0:
+            per_hour = pd.read_sql_query("""
+                SELECT CAST(strftime('%H', order_time) AS INTEGER) AS hour, COUNT(*) AS customers
+                FROM orders
+                GROUP BY hour
+            """, _conn)
+            # Scatter into a fixed 24-slot array so empty hours come out as 0 without a merge
+            counts[per_hour['hour'].to_numpy()] = per_hour['customers'].to_numpy()
+        return pa.table({'hour': np.arange(24), 'customers': counts})
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def compute_low_stock(_conn: Connection, version: int, last_30: str, threshold=2) -> pa.Table:
+    # last_30 is part of the cache key, so a result never outlives its 30-day window
+    with get_read_lock():
+        low = pd.read_sql_query("""
+            SELECT p.id, p.name, p.stock_qty,
+                   COALESCE(SUM(CASE WHEN o.order_time >= ? THEN oi.qty END), 0) AS sold_last_30d
+            FROM products p
+            LEFT JOIN order_items oi ON oi.product_id = p.id
+            LEFT JOIN orders o ON o.id = oi.order_id
+            WHERE p.stock_qty < ?
+            GROUP BY p.id
+        """, _conn, params=(last_30, threshold))
+        return _to_arrow(low)
 
 # --------------------------
 # Streamlit UI
@@ -161,13 +262,23 @@ def compute_low_stock(products, order_items, threshold=2):
 st.set_page_config(page_title="Daily Shop Dashboard", layout="wide")
 st.title("🛒 Daily-Needs Shop Analytics Dashboard")
 
-conn = get_conn()
-init_db(conn)
-seed_dummy_data(conn)
+@st.cache_resource
+def bootstrap() -> Connection:
+    # Schema setup and seeding run once per process, not on every rerun
+    conn = get_conn()
+    with get_write_lock(), conn:
+        init_db(conn)
+        seed_dummy_data(conn)
+    return conn
+
+conn = bootstrap()
+read_conn = get_conn(readonly=True)
+
+version = get_data_version()['value']
 
 mode = st.sidebar.selectbox("Select Mode", ["Dashboard", "Admin - Manage Products", "Admin - Add Order","Power BI Dashboard"])
 
-products_df, orders_df, order_items_df = load_tables(conn)
+products_df = load_tables(read_conn, version)
 
 # --------------------------
 # Dashboard
@@ -178,28 +289,26 @@ if mode == "Dashboard":
     col1, col2 = st.columns(2)
     with col1:
         st.subheader("🔥 Best Selling Products")
-        best = compute_best_selling(order_items_df)
+        best = compute_best_selling(read_conn, version).to_pandas()
         st.dataframe(best.rename(columns={'qty':'Units Sold'}))
 
         st.subheader("💰 Top Products by Profit")
-        profit_df = compute_top_profit_products(order_items_df)
+        profit_df = compute_top_profit_products(read_conn, version).to_pandas()
         st.dataframe(profit_df)
 
     with col2:
         st.subheader("⏰ Customers per Hour")
-        per_hour = compute_customers_per_hour(orders_df)
-        fig, ax = plt.subplots(figsize=(6,3))
-        ax.bar(per_hour['hour'], per_hour['customers'])
-        ax.set_xlabel("Hour of Day")
-        ax.set_ylabel("Customers")
-        st.pyplot(fig)
+        per_hour = compute_customers_per_hour(read_conn, version).to_pandas()
+        st.bar_chart(per_hour.set_index('hour'), x_label="Hour of Day", y_label="Customers")
 
         st.subheader("⚠️ Low Stock Products (<2)")
-        low_df = compute_low_stock(products_df, order_items_df)
-        if low_df.empty:
+        # Day granularity keeps reruns within a day on the cached result
+        last_30 = (datetime.now() - timedelta(days=30)).date().isoformat()
+        low = compute_low_stock(read_conn, version, last_30)
+        if low.num_rows == 0:
             st.success("No low stock products.")
         else:
-            st.dataframe(low_df)
+            st.dataframe(low.to_pandas())
 
 elif mode == "Power BI Dashboard":
     st.title("📊 Power BI Business Analytics Dashboard")
@@ -227,10 +336,11 @@ elif mode == "Admin - Manage Products":
         sell = st.number_input("Selling price (₹)", min_value=0.0)
         stock = st.number_input("Initial stock", min_value=0, step=1)
         if st.form_submit_button("Add Product"):
-            cur = conn.cursor()
-            cur.execute("INSERT INTO products (name, cost_price, selling_price, stock_qty) VALUES (?, ?, ?, ?)",
-                        (pname, cost, sell, stock))
-            conn.commit()
+            with get_write_lock():
+                with conn:
+                    conn.execute("INSERT INTO products (name, cost_price, selling_price, stock_qty) VALUES (?, ?, ?, ?)",
+                                 (pname, cost, sell, stock))
+                get_data_version()['value'] += 1
             st.success("Product added successfully.")
             st.rerun()
 
@@ -239,9 +349,10 @@ elif mode == "Admin - Manage Products":
         pid = st.number_input("Enter Product ID", min_value=1, step=1)
         add_qty = st.number_input("Add Quantity", min_value=1, step=1)
         if st.form_submit_button("Update Stock"):
-            cur = conn.cursor()
-            cur.execute("UPDATE products SET stock_qty = stock_qty + ? WHERE id = ?", (add_qty, pid))
-            conn.commit()
+            with get_write_lock():
+                with conn:
+                    conn.execute("UPDATE products SET stock_qty = stock_qty + ? WHERE id = ?", (add_qty, pid))
+                get_data_version()['value'] += 1
             st.success(f"Added {add_qty} units to Product ID {pid}.")
             st.rerun()
 
@@ -251,7 +362,11 @@ elif mode == "Admin - Manage Products":
 elif mode == "Admin - Add Order":
     st.header("🧾 Create Order & Generate Bill")
 
-    product_choices = {f"{r['id']}: {r['name']} (₹{r['selling_price']}, stock {r['stock_qty']})": r['id'] for _,r in products_df.iterrows()}
+    labels = (products_df['id'].astype(str) + ": " + products_df['name'].astype(str)
+              + " (₹" + products_df['selling_price'].astype(str)
+              + ", stock " + products_df['stock_qty'].astype(str) + ")")
+    product_choices = dict(zip(labels.tolist(), products_df['id'].tolist()))
+    prod_by_id = products_df.set_index('id')[['name','cost_price','selling_price']]
     if not product_choices:
         st.info("No products found. Add products first.")
     else:
@@ -267,31 +382,34 @@ elif mode == "Admin - Add Order":
                 st.rerun()
 
         st.subheader("Current Items")
-        lines = []
-        for item in st.session_state['order_items_tmp']:
-            p = products_df[products_df['id']==item['product_id']].iloc[0]
-            lines.append({
-                'Product': p['name'],
-                'Qty': item['qty'],
-                'Unit Price': p['selling_price'],
-                'Line Total': p['selling_price']*item['qty']
+        items_df = pd.DataFrame(st.session_state['order_items_tmp'], columns=['product_id','qty'])
+        if not items_df.empty:
+            items_df = items_df.join(prod_by_id, on='product_id')
+            bill_df = pd.DataFrame({
+                'Product': items_df['name'],
+                'Qty': items_df['qty'],
+                'Unit Price': items_df['selling_price'],
+                'Line Total': items_df['selling_price']*items_df['qty']
             })
-        if lines:
-            bill_df = pd.DataFrame(lines)
             st.table(bill_df)
             total_amt = bill_df['Line Total'].sum()
             if st.button("Finalize Order"):
-                cur = conn.cursor()
-                cur.execute("INSERT INTO orders (order_time, customer_name, total_amount) VALUES (?, ?, ?)", (order_time, cust, total_amt))
-                oid = cur.lastrowid
-                for item in st.session_state['order_items_tmp']:
-                    cur.execute("SELECT selling_price FROM products WHERE id=?", (item['product_id'],))
-                    price = cur.fetchone()['selling_price']
-                    cur.execute("INSERT INTO order_items (order_id, product_id, qty, unit_price) VALUES (?, ?, ?, ?)",
-                                (oid, item['product_id'], item['qty'], price))
-                    cur.execute("UPDATE products SET stock_qty = CASE WHEN stock_qty - ? < 0 THEN 0 ELSE stock_qty - ? END WHERE id = ?",
-                                (item['qty'], item['qty'], item['product_id']))
-                conn.commit()
+                with get_write_lock():
+                    # Order row, line items, stock and stats all land in one transaction;
+                    # any failure rolls it back so the shared connection is left clean
+                    with conn:
+                        cur = conn.cursor()
+                        cur.execute("INSERT INTO orders (order_time, customer_name, total_amount) VALUES (?, ?, ?)",
+                                    (order_time, cust, float(total_amt)))
+                        oid = cur.lastrowid
+                        pids, qtys = items_df['product_id'].tolist(), items_df['qty'].tolist()
+                        cur.executemany("INSERT INTO order_items (order_id, product_id, qty, unit_price, product_name, cost_price) VALUES (?, ?, ?, ?, ?, ?)",
+                                        zip([oid] * len(pids), pids, qtys, items_df['selling_price'].tolist(),
+                                            items_df['name'].tolist(), items_df['cost_price'].tolist()))
+                        cur.executemany("UPDATE products SET stock_qty = MAX(stock_qty - ?, 0) WHERE id = ?", zip(qtys, pids))
+                        profits = ((items_df['selling_price'] - items_df['cost_price']) * items_df['qty']).tolist()
+                        add_order_stats(conn, zip(pids, qtys, profits))
+                    get_data_version()['value'] += 1
 
                 st.success(f"Order saved (ID {oid}). Total ₹{total_amt:.2f}")
                 st.session_state['order_items_tmp'] = []